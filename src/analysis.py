@@ -0,0 +1,145 @@
+import numpy as np
+
+
+# Default analysis configuration
+SR = 44100
+BLOCKSIZE = 256  # capture block, sets input latency
+FFT_SIZE = 4096  # analysis window, sets frequency resolution
+OVERLAP = 0.75
+N_BARS = 1024  # display bands the spectrum is reduced to
+REF = 1.0  # magnitude shown as 0 dB (full scale sine)
+DB_FLOOR = -80.0  # level shown as an empty bar
+
+
+class AnalysisConfig:
+    """Capture and spectrum analysis settings
+
+    The capture block size only controls latency; the FFT size and hop
+    control resolution and update rate, and the number of display bars is
+    independent of both.
+    """
+
+    def __init__(self, sample_rate=SR, blocksize=BLOCKSIZE, fft_size=FFT_SIZE,
+                 overlap=OVERLAP, n_bars=N_BARS, ref=REF, db_floor=DB_FLOOR):
+        for name, value in (("fft_size", fft_size), ("blocksize", blocksize),
+                            ("n_bars", n_bars)):
+            if value <= 0:
+                raise ValueError(f"{name} must be positive, got {value}")
+        if fft_size < 2:
+            raise ValueError(f"fft_size must be at least 2, got {fft_size}")
+        if not 0 <= overlap < 1:
+            raise ValueError(f"overlap must be in [0, 1), got {overlap}")
+        if db_floor >= 0:
+            raise ValueError(f"db_floor must be negative, got {db_floor}")
+        self.sample_rate = sample_rate
+        self.blocksize = blocksize
+        self.fft_size = fft_size
+        self.overlap = overlap
+        # at most one bar per FFT bin, more would just draw bins twice
+        self.n_bars = min(n_bars, self.n_bins)
+        self.ref = ref
+        self.db_floor = db_floor
+
+        self.window = np.hamming(fft_size)
+        # scale so a full scale sine peaks at a magnitude of 1
+        self.scale = 2.0 / self.window.sum()
+        # first FFT bin of each display band
+        self.band_starts = np.linspace(0, self.n_bins, self.n_bars, endpoint=False).astype(np.intp)
+
+    @property
+    def hop(self):
+        """Samples between consecutive analysis frames"""
+        return max(1, int(round(self.fft_size * (1 - self.overlap))))
+
+    @property
+    def n_bins(self):
+        return self.fft_size // 2
+
+    @property
+    def latency(self):
+        """Capture latency in seconds"""
+        return self.blocksize / self.sample_rate
+
+
+def batch_spectrum(frames, config):
+    """Band magnitudes for an (..., fft_size) array of windows
+
+    Magnitudes are scaled so a full scale sine reads 1, then reduced to
+    `config.n_bars` bands by taking the loudest bin in each. Conversion to
+    dB happens later in `processing.SpectrumProcessor`.
+    """
+    fft = np.fft.rfft(frames * config.window, axis=-1)
+    magnitude = np.abs(fft[..., :config.n_bins]) * config.scale
+    return np.maximum.reduceat(magnitude, config.band_starts, axis=-1)
+
+
+class RingBuffer:
+    """Fixed size sample history written from the audio callback"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        self.written = 0  # total samples ever written
+
+    def write(self, block):
+        n = len(block)
+        block = block[-self.capacity:]
+        start = (self.written + n - len(block)) % self.capacity
+        end = start + len(block)
+        if end <= self.capacity:
+            self.buffer[start:end] = block
+        else:
+            split = self.capacity - start
+            self.buffer[start:] = block[:split]
+            self.buffer[:end - self.capacity] = block[split:]
+        self.written += n
+
+    def read(self, start, stop=None):
+        """Samples in absolute range [start, stop), clipped to what is still held"""
+        stop = self.written if stop is None else stop
+        start = max(start, stop - self.capacity)
+        return self.buffer[np.arange(start, stop) % self.capacity]
+
+    def latest(self, n):
+        """Most recent n samples, zero padded before the first write"""
+        return self.read(self.written - n)
+
+    def reset(self):
+        self.buffer[:] = 0
+        self.written = 0
+
+
+class SlidingWindow:
+    """Analysis window sliding over captured audio by `config.hop` samples"""
+
+    def __init__(self, config):
+        self.config = config
+        self.ring = RingBuffer(config.fft_size + config.sample_rate)
+        self.analysed = 0
+        self.consumed = 0
+
+    def write(self, block):
+        self.ring.write(block)
+
+    def ready(self):
+        """Check if at least one hop of new audio has arrived"""
+        return self.ring.written - self.analysed >= self.config.hop
+
+    def next_window(self):
+        """Latest fft_size samples; skips any hops missed while the UI was busy"""
+        # snapshot once, the audio callback may write between two reads
+        stop = self.ring.written
+        self.analysed = stop
+        return self.ring.read(stop - self.config.fft_size, stop)
+
+    def read_new(self):
+        """All samples written since the previous call"""
+        stop = self.ring.written
+        data = self.ring.read(self.consumed, stop)
+        self.consumed = stop
+        return data
+
+    def reset(self):
+        self.ring.reset()
+        self.analysed = 0
+        self.consumed = 0
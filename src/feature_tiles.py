@@ -0,0 +1,168 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from session import FEATURE_FRAME, frame_features
+
+
+TILE_FRAMES = 256  # frames per tile at every hop
+HOPS = (512, 256, 128, 64)  # 512 is librosa's default used for the whole file
+TARGET_POINTS = 1000  # feature frames wanted across the visible window
+CACHE_TILES = 256
+ENVELOPE_BASE = 64  # samples per (min, max) pair at the finest envelope level
+ENVELOPE_FACTOR = 4  # buckets merged into one at each coarser level
+
+
+def choose_hop(n_samples):
+    """Coarsest hop that still gives TARGET_POINTS frames over n_samples"""
+    for hop in HOPS:
+        if n_samples / hop >= TARGET_POINTS:
+            return hop
+    return HOPS[-1]
+
+
+def tile_keys(n_samples, sr, t0, t1, hop):
+    """(tile, hop) keys covering the time range [t0, t1]"""
+    n_frames = 1 + n_samples // hop
+    first = max(int(t0 * sr) // hop, 0)
+    last = min(int(np.ceil(t1 * sr / hop)), n_frames - 1)
+    return [(tile, hop) for tile in range(first // TILE_FRAMES, last // TILE_FRAMES + 1)]
+
+
+def compute_tile(read, n_samples, sr, tile, hop):
+    """Times, spectral centroid and ZCR for one tile of frames
+
+    `read(start, stop)` returns samples [start, stop) of the audio, so only
+    the tile's own samples are loaded. Frames are centred on multiples of
+    `hop` like librosa's default `center=True`, so tiles line up with each
+    other and the whole file curves.
+    """
+    first_frame = tile * TILE_FRAMES
+    n = min(TILE_FRAMES, 1 + n_samples // hop - first_frame)
+    start = first_frame * hop
+    half = FEATURE_FRAME // 2
+    lo = start - half
+    hi = start + (n - 1) * hop + half
+    segment = np.pad(read(max(lo, 0), min(hi, n_samples)), (max(-lo, 0), max(hi - n_samples, 0)))
+
+    features = frame_features(segment, sr, hop)
+    times = (first_frame + np.arange(n)) * hop / sr
+    return times, features[:n, 1], features[:n, 2]
+
+
+def _reduce(lows, highs, step):
+    """Min of lows and max of highs over every `step` values, edge padding the last bucket"""
+    pad = -len(lows) % step
+    lows = np.pad(lows, (0, pad), mode='edge').reshape(-1, step).min(axis=1)
+    highs = np.pad(highs, (0, pad), mode='edge').reshape(-1, step).max(axis=1)
+    return lows, highs
+
+
+class EnvelopePyramid:
+    """Min/max envelope of a signal at several resolutions
+
+    Level k holds the (min, max) of every ENVELOPE_BASE * ENVELOPE_FACTOR ** k
+    samples, so a wide view is drawn from a few thousand precomputed pairs
+    instead of reducing all of its samples again on every pan or zoom.
+    """
+
+    def __init__(self, y):
+        size = ENVELOPE_BASE
+        lows, highs = _reduce(y, y, size)
+        self.levels = [(size, lows, highs)]
+        while len(lows) > ENVELOPE_FACTOR:
+            lows, highs = _reduce(lows, highs, ENVELOPE_FACTOR)
+            size *= ENVELOPE_FACTOR
+            self.levels.append((size, lows, highs))
+
+    def query(self, first, last, points):
+        """Bucket start samples, lows and highs over [first, last) from the coarsest
+        level that still has `points` buckets there"""
+        size, lows, highs = self.levels[0]
+        for level in self.levels[1:]:
+            if (last - first) // level[0] < points:
+                break
+            size, lows, highs = level
+        lo, hi = first // size, -(-last // size)
+        return np.arange(lo, hi) * size, lows[lo:hi], highs[lo:hi]
+
+
+class TileCache:
+    """LRU cache of feature tiles keyed by (tile, hop)"""
+
+    def __init__(self, max_tiles=CACHE_TILES):
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+            return tile
+
+    def put(self, key, tile):
+        with self.lock:
+            self.tiles[key] = tile
+            self.tiles.move_to_end(key)
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+
+    def put_if(self, key, tile, predicate):
+        """Store tile only if predicate() holds, checked under the lock; returns whether it did"""
+        with self.lock:
+            if not predicate():
+                return False
+            self.put(key, tile)
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+
+    def lookup(self, keys):
+        """Stitched (times, centroid, zcr) for keys, or None plus the missing keys"""
+        tiles = [self.get(key) for key in keys]
+        missing = [key for key, tile in zip(keys, tiles) if tile is None]
+        if missing or not tiles:
+            return None, missing
+        return tuple(np.concatenate(parts) for parts in zip(*tiles)), []
+
+
+class FeatureWorker(QObject):
+    """Computes missing tiles in a background thread"""
+
+    tiles_ready = pyqtSignal(int)  # emitted with the request id once its tiles are cached
+
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.latest = 0
+
+    def request(self, read, n_samples, sr, keys):
+        """Queue tiles for computation, superseding any earlier request"""
+        self.latest += 1
+        self.executor.submit(self._compute, self.latest, read, n_samples, sr, keys)
+        return self.latest
+
+    def invalidate(self):
+        """Drop cached tiles and any in-flight request, e.g. when the audio changes"""
+        # under the cache lock, so no tile of the old audio can be stored after the clear
+        with self.cache.lock:
+            self.latest += 1
+            self.cache.clear()
+
+    def _compute(self, request_id, read, n_samples, sr, keys):
+        for key in keys:
+            if request_id != self.latest:
+                return  # the view moved on, leave the rest
+            if self.cache.get(key) is None:
+                tile = compute_tile(read, n_samples, sr, *key)
+                if not self.cache.put_if(key, tile, lambda: request_id == self.latest):
+                    return
+        self.tiles_ready.emit(request_id)
@@ -2,14 +2,24 @@ import os
 import sys
 import librosa
 import numpy as np
+from PyQt6.QtCore import QTimer
 from PyQt6.QtWidgets import QApplication, QVBoxLayout, QWidget
 import matplotlib
 matplotlib.use('QtAgg')
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
+from feature_tiles import (ENVELOPE_BASE, HOPS, EnvelopePyramid, FeatureWorker, TileCache,
+                           choose_hop, tile_keys)
+from session import Session
+
 FONTSIZE = 8
 SR = 44100
+ZOOM_STEP = 1.25  # view scale per scroll wheel step
+MIN_VIEW_SAMPLES = 64
+MAX_WAVE_POINTS = 4000  # min/max pairs drawn for the waveform
+MAX_READ_SAMPLES = 2 ** 22  # wider session views draw the stored per frame envelope
+RECOMPUTE_DELAY = 100  # ms for zooming to settle before features are recomputed
 
 class MplCanvas(FigureCanvas):
     def __init__(self, parent=None, width=8, height=4, dpi=100):
@@ -21,6 +31,22 @@ class AudioFeatureExtractor():
         self.audio_data = initial_data if initial_data else np.array([0.0])
         self.sample_rate = sample_rate
         self.loadLabel = loadLabel
+        self.session = None
+        self.envelope = None  # EnvelopePyramid of audio_data, built for the first wide view
+
+        # zoom state, view is the visible (start, end) in seconds or None for everything
+        self.view = None
+        self.overview = None  # whole file (times, centroid, zcr)
+        self.overview_hop = HOPS[0]
+        self.pending_tiles = []
+        self._drag = None
+        self.tiles = TileCache()
+        self.worker = FeatureWorker(self.tiles)
+        self.worker.tiles_ready.connect(self.on_tiles_ready)
+        self.recompute_timer = QTimer()
+        self.recompute_timer.setSingleShot(True)
+        self.recompute_timer.setInterval(RECOMPUTE_DELAY)
+        self.recompute_timer.timeout.connect(self.request_tiles)
 
         # matplotlib for visuals
         self.waveform_canvas = MplCanvas(self, width=8, height=2)
@@ -28,13 +54,14 @@ class AudioFeatureExtractor():
         self.zcr_canvas = MplCanvas(self, width=8, height=2)
 
         self.setup_plots()
+        self.connect_zoom()
 
     def load_audio(self, filename):
         if filename:
             try:
                 if self.loadLabel:
                     self.loadLabel.setText(f'Loading: {filename.split("/")[-1]}...')
-                self.audio_data, self.sample_rate = librosa.load(filename, sr=None)
+                self.set_audio(*librosa.load(filename, sr=None))
                 if self.loadLabel:
                     self.loadLabel.setText(f'Loaded: {filename.split("/")[-1]} (SR: {self.sample_rate} Hz)')
                 self.extract_and_visualize()
@@ -43,6 +70,30 @@ class AudioFeatureExtractor():
                     self.loadLabel.setText(f'Error: {str(e)}')
                 print(f'Error: {str(e)}')
 
+    def load_session(self, filename):
+        """Replay a saved capture session using its stored features"""
+        if filename:
+            try:
+                session = Session(filename)
+                # samples are read from the session's memory map as the view needs them
+                self.set_audio(np.array([0.0]), session.sample_rate, session)
+                if self.loadLabel:
+                    self.loadLabel.setText(f'Session: {filename.split("/")[-1]} '
+                                           f'({self.session.duration:.1f} s)')
+                self.visualize_session()
+            except Exception as e:
+                if self.loadLabel:
+                    self.loadLabel.setText(f'Error: {str(e)}')
+                print(f'Error: {str(e)}')
+
+    def visualize_session(self):
+        # features were computed during capture, so nothing is recomputed here
+        if not len(self.session):
+            return
+        features = self.session.features
+        self.overview_hop = int(np.median(self.session.frame_lengths))
+        self.set_overview(self.session.frame_times, features[:, 1], features[:, 2])
+
     def setup_plots(self):
         # Waveform
         ax = self.waveform_canvas.fig.add_subplot(111)
@@ -80,52 +131,203 @@ class AudioFeatureExtractor():
         ax.grid(True, alpha=0.3)
         self.zcr_canvas.fig.tight_layout()
     
+    def set_audio(self, audio_data, sample_rate, session=None):
+        """Replace the audio, dropping the previous session, view and cached tiles with it"""
+        self.audio_data = audio_data
+        self.sample_rate = sample_rate
+        self.session = session
+        self.envelope = None
+        self.view = None
+        self.worker.invalidate()
+
     def update_audio_data(self, data, sr=SR):
+        if self.session is not None:
+            # live input starts fresh rather than extending a replayed session
+            self.reset_audio_data()
         self.audio_data = np.append(self.audio_data, data)
         self.sample_rate = sr
+        self.envelope = None
 
     def reset_audio_data(self):
-        self.audio_data = np.array([0.0])
+        self.set_audio(np.array([0.0]), self.sample_rate)
 
     def extract_and_visualize(self):
         if self.audio_data is None:
             return
         y = self.audio_data
         sr = self.sample_rate
-        # 1. Waveform - Volume
-        self.plot_waveform(y, sr)
-        # 2. Spectral Centroid - Brightness
+        # 1. Spectral Centroid - Brightness
         spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-        self.plot_spectral_centroid(spectral_centroids, sr)
-        # 3. Zero Crossing Rate - Percussion/Beats
+        # 2. Zero Crossing Rate - Percussion/Beats
         zcr = librosa.feature.zero_crossing_rate(y)[0]
-        self.plot_zcr(zcr, sr)
+        t = librosa.frames_to_time(range(len(zcr)), sr=sr)
+        self.overview_hop = HOPS[0]
+        # 3. Waveform - Volume, plotted with the rest for the current view
+        self.set_overview(t, spectral_centroids, zcr)
+
+    def set_overview(self, t, spectral_centroids, zcr):
+        """Store whole file feature curves and replot the current view"""
+        self.overview = (t, spectral_centroids, zcr)
+        self.worker.invalidate()
+        self.refresh_view()
+
+    def refresh_view(self):
+        """Plot the visible part of all three panels"""
+        sr = self.sample_rate
+        start, end = self.current_view()
+        first = int(start * sr)
+        last = min(int(np.ceil(end * sr)) + 1, self.audio_length())
+        if self.session is not None and last - first > MAX_READ_SAMPLES:
+            self.plot_session_envelope(start, end)
+        elif self.session is None and last - first > ENVELOPE_BASE * MAX_WAVE_POINTS:
+            self.plot_file_envelope(first, last)
+        else:
+            self.plot_waveform(self.read_audio(first, last), sr, offset=first)
+        t, spectral_centroids, zcr = self.visible_features(start, end)
+        self.plot_spectral_centroid(spectral_centroids, sr, t)
+        self.plot_zcr(zcr, sr, t)
+        for ax in (self.waveform_ax, self.spectral_ax, self.zcr_ax):
+            ax.set_xlim(start, end)
+
+    def visible_features(self, start, end):
+        """Feature curves over the view, from finer cached tiles when zoomed in"""
+        t, spectral_centroids, zcr = self.overview
+        hop = choose_hop((end - start) * self.sample_rate)
+        if self.view and hop < self.overview_hop:
+            keys = tile_keys(self.audio_length(), self.sample_rate, start, end, hop)
+            tiles, missing = self.tiles.lookup(keys)
+            if tiles:
+                t, spectral_centroids, zcr = tiles
+            else:
+                # show the coarse curves until the worker catches up
+                self.pending_tiles = missing
+                self.recompute_timer.start()
+        lo = max(np.searchsorted(t, start) - 1, 0)
+        hi = np.searchsorted(t, end) + 1
+        return t[lo:hi], spectral_centroids[lo:hi], zcr[lo:hi]
 
-    def plot_waveform(self, y, sr):
-        times = np.arange(len(y)) / sr
+    def request_tiles(self):
+        if self.pending_tiles:
+            self.worker.request(self.read_audio, self.audio_length(), self.sample_rate,
+                                self.pending_tiles)
+            self.pending_tiles = []
+
+    def on_tiles_ready(self, request_id):
+        if request_id == self.worker.latest:
+            self.refresh_view()
+
+    def connect_zoom(self):
+        """Scroll to zoom, drag to pan and double click to reset, across all three panels"""
+        for canvas in (self.waveform_canvas, self.spectral_canvas, self.zcr_canvas):
+            canvas.mpl_connect('scroll_event', self.on_scroll)
+            canvas.mpl_connect('button_press_event', self.on_press)
+            canvas.mpl_connect('motion_notify_event', self.on_motion)
+            canvas.mpl_connect('button_release_event', self.on_release)
+
+    def audio_length(self):
+        if self.session is not None:
+            return self.session.n_samples
+        return len(self.audio_data)
+
+    def read_audio(self, first, last):
+        """Samples [first, last), seeking through the session file when replaying one"""
+        if self.session is not None:
+            return self.session.read(first, last)
+        return self.audio_data[first:last]
+
+    def current_view(self):
+        return self.view or (0, self.audio_length() / self.sample_rate)
+
+    def set_view(self, start, end):
+        if self.overview is None:
+            return
+        duration = self.audio_length() / self.sample_rate
+        width = min(max(end - start, MIN_VIEW_SAMPLES / self.sample_rate), duration)
+        start = min(max(start, 0), duration - width)
+        self.view = None if width >= duration else (start, start + width)
+        self.refresh_view()
+
+    def on_scroll(self, event):
+        if event.xdata is None:
+            return
+        start, end = self.current_view()
+        scale = ZOOM_STEP ** -event.step
+        x = event.xdata
+        self.set_view(x - (x - start) * scale, x + (end - x) * scale)
+
+    def on_press(self, event):
+        if event.button != 1 or event.inaxes is None:
+            return
+        if event.dblclick:
+            self.set_view(0, self.audio_length() / self.sample_rate)
+        else:
+            self._drag = (event.x, self.current_view(), event.inaxes.bbox.width)
+
+    def on_motion(self, event):
+        if self._drag is None:
+            return
+        x, (start, end), width = self._drag
+        shift = (event.x - x) * (end - start) / width
+        self.set_view(start - shift, end - shift)
+
+    def on_release(self, event):
+        self._drag = None
+
+    def plot_session_envelope(self, start, end):
+        """Waveform of a wide session view from per frame (min, max), without reading samples"""
+        first = self.session.seek(start)
+        last = self.session.seek(end) + 1
+        lows, highs = self.session.envelope
+        y = np.column_stack((lows[first:last], highs[first:last])).ravel()
+        times = np.repeat(self.session.frame_times[first:last], 2)
+        self.plot_waveform(y, self.sample_rate, times=times)
+
+    def plot_file_envelope(self, first, last):
+        """Waveform of a wide file view from the cached min/max envelope"""
+        if self.envelope is None:
+            self.envelope = EnvelopePyramid(self.audio_data)
+        positions, lows, highs = self.envelope.query(first, last, MAX_WAVE_POINTS)
+        y = np.column_stack((lows, highs)).ravel()
+        times = np.repeat(positions / self.sample_rate, 2)
+        self.plot_waveform(y, self.sample_rate, times=times)
+
+    def plot_waveform(self, y, sr, offset=0, times=None):
+        if not len(y):
+            return
+        if times is None:
+            times = (offset + np.arange(len(y))) / sr
+        if len(y) > 2 * MAX_WAVE_POINTS:
+            # min/max per bucket keeps peaks visible without drawing every sample
+            step = len(y) // MAX_WAVE_POINTS
+            n = len(y) // step * step
+            buckets = y[:n].reshape(-1, step)
+            y = np.column_stack((buckets.min(axis=1), buckets.max(axis=1))).ravel()
+            times = np.repeat(times[:n:step], 2)
         # self.waveform_ax.plot(times, y, linewidth=0.5, alpha=0.7, color='blue')
         self.waveform_line.set_data(times, y)
-        self.waveform_ax.set_xlim(min(times), max(times))
-        self.waveform_ax.set_ylim(min(y), max(y))
-        self.waveform_canvas.draw()
+        self.waveform_ax.set_xlim(times[0], times[-1])
+        self.waveform_ax.set_ylim(y.min(), y.max())
+        self.waveform_canvas.draw_idle()
 
-    def plot_spectral_centroid(self, spectral_centroids, sr):
+    def plot_spectral_centroid(self, spectral_centroids, sr, t=None):
         
-        frames = range(len(spectral_centroids))
-        t = librosa.frames_to_time(frames, sr=sr)
+        if t is None:
+            frames = range(len(spectral_centroids))
+            t = librosa.frames_to_time(frames, sr=sr)
         self.spectral_line.set_data(t, spectral_centroids)
         self.spectral_ax.set_xlim(min(t), max(t))
         self.spectral_ax.set_ylim(min(spectral_centroids), max(spectral_centroids))
-        self.spectral_canvas.draw()
+        self.spectral_canvas.draw_idle()
 
-    def plot_zcr(self, zcr, sr):
+    def plot_zcr(self, zcr, sr, t=None):
         
-        frames = range(len(zcr))
-        t = librosa.frames_to_time(frames, sr=sr)
+        if t is None:
+            frames = range(len(zcr))
+            t = librosa.frames_to_time(frames, sr=sr)
         self.zcr_line.set_data(t, zcr)
         self.zcr_ax.set_xlim(min(t), max(t))
         self.zcr_ax.set_ylim(min(zcr), max(zcr))
-        self.zcr_canvas.draw()
+        self.zcr_canvas.draw_idle()
 
 
 if __name__ == "__main__":
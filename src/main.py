@@ -1,16 +1,45 @@
 ### Runs main program ###
 
+import argparse
 import sys
 from PyQt6.QtWidgets import QApplication
+
+from analysis import (BLOCKSIZE, DB_FLOOR, FFT_SIZE, N_BARS, OVERLAP, SR,
+                      AnalysisConfig)
 from qt_live_input import AudioVisualizer
+from session import MAX_SESSION_MB, SESSION_DIR
+
+
+def parse_args(argv):
+    """Analysis settings from the command line, anything else is left for Qt"""
+    parser = argparse.ArgumentParser(description="Python Audio Visualizer")
+    parser.add_argument("--sample-rate", type=int, default=SR)
+    parser.add_argument("--blocksize", type=int, default=BLOCKSIZE,
+                        help="capture block size, lower for less latency")
+    parser.add_argument("--fft-size", type=int, default=FFT_SIZE,
+                        help="analysis window, higher for finer frequency resolution")
+    parser.add_argument("--overlap", type=float, default=OVERLAP)
+    parser.add_argument("--bars", type=int, default=N_BARS)
+    parser.add_argument("--db-floor", type=float, default=DB_FLOOR)
+    parser.add_argument("--no-record", action="store_true",
+                        help="don't save live captures as session files")
+    parser.add_argument("--session-dir", default=SESSION_DIR)
+    parser.add_argument("--max-session-mb", type=float, default=MAX_SESSION_MB,
+                        help="stop recording a session once its file reaches this size")
+    return parser.parse_known_args(argv)
 
 
 def main():
-    app = QApplication(sys.argv)
-    window = AudioVisualizer()
+    args, qt_args = parse_args(sys.argv[1:])
+    config = AnalysisConfig(sample_rate=args.sample_rate, blocksize=args.blocksize,
+                            fft_size=args.fft_size, overlap=args.overlap,
+                            n_bars=args.bars, db_floor=args.db_floor)
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = AudioVisualizer(config, record=not args.no_record, session_dir=args.session_dir,
+                             max_session_mb=args.max_session_mb)
     window.show()
     sys.exit(app.exec())
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,257 @@
+### Renders visualization modes offline to a PNG sequence or video ###
+
+import argparse
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+import time
+from collections import deque
+
+import librosa
+import numpy as np
+
+from analysis import FFT_SIZE, AnalysisConfig, batch_spectrum
+from processing import SpectrumProcessor
+from vis_manager import VisualizationManager, create_plot_widget
+
+
+FPS = 30
+WIDTH = 1280
+HEIGHT = 720
+WARMUP_FRAMES = 8  # frames replayed before each range so band smoothing carries over
+ANALYSIS_BLOCK = 4096  # frames per batched FFT, bounds peak memory on long files
+TASKS_PER_WORKER = 2  # rendered ranges allowed in flight per worker
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".mov", ".webm")
+EXPORT_MODES = ("Waveform", "Frequency Bars", "Spectrum Line",
+                "Circular Spectrum", "Stereo Bars")
+
+# Per-process render state, filled in by _init_worker
+_worker = {}
+
+
+def frame_starts(n_samples, sample_rate, fps):
+    """Sample position of every video frame
+
+    Each frame's analysis window is the `fft_size` samples ending here, as in
+    the live view, so audio is front padded by `fft_size` and these offsets
+    index the padded signal directly.
+    """
+    n_frames = int(np.ceil(n_samples * fps / sample_rate))
+    return np.arange(n_frames, dtype=np.int64) * sample_rate // fps
+
+
+def analyse(y, starts, config):
+    """Spectra and sample peaks for every frame, computed as one vectorised STFT over the file"""
+    padded = np.pad(y, (config.fft_size, 0))
+    windows = np.lib.stride_tricks.sliding_window_view(padded, config.fft_size)
+    spectra = np.empty((len(starts), config.n_bars), dtype=np.float32)
+    peaks = np.empty(len(starts), dtype=np.float32)
+    for i in range(0, len(starts), ANALYSIS_BLOCK):
+        frames = windows[starts[i:i + ANALYSIS_BLOCK]]
+        spectra[i:i + len(frames)] = batch_spectrum(frames, config)
+        peaks[i:i + len(frames)] = np.abs(frames).max(axis=1)
+    return spectra, peaks
+
+
+def _init_worker(mode, config, fps, width, height, sensitivity, use_exporter=False):
+    """Create an offscreen Qt app and plot for this process"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtGui import QImage
+    from PyQt6.QtWidgets import QApplication
+    import pyqtgraph.exporters
+
+    app = QApplication.instance() or QApplication([])
+    plot_widget = create_plot_widget()
+    plot_widget.resize(width, height)
+    viz_manager = VisualizationManager(plot_widget, None, config, frame_rate=fps)
+    viz_manager.setup(mode)
+    viz_manager.processor.sensitivity = sensitivity
+    plot_widget.show()
+    app.processEvents()
+
+    exporter = None
+    if use_exporter:
+        exporter = pyqtgraph.exporters.ImageExporter(plot_widget.getPlotItem())
+        exporter.parameters()['width'] = width
+
+    _worker.update(app=app, fft_size=config.fft_size,
+                   width=width, height=height, plot_widget=plot_widget,
+                   viz_manager=viz_manager, exporter=exporter,
+                   image=QImage(width, height, QImage.Format.Format_RGBA8888))
+
+
+def _render_image():
+    """Paint the plot into the worker's reused frame image"""
+    from PyQt6.QtCore import Qt
+    from PyQt6.QtGui import QImage, QPainter
+
+    width, height = _worker['width'], _worker['height']
+    if _worker['exporter']:
+        # much slower, kept as a fallback for platforms where widget rendering fails
+        image = _worker['exporter'].export(toBytes=True)
+        if image.width() != width or image.height() != height:
+            image = image.scaled(width, height, Qt.AspectRatioMode.IgnoreAspectRatio,
+                                 Qt.TransformationMode.SmoothTransformation)
+        return image.convertToFormat(QImage.Format.Format_RGBA8888)
+
+    image = _worker['image']
+    painter = QPainter(image)
+    _worker['plot_widget'].render(painter)
+    painter.end()
+    return image
+
+
+def _render_range(task):
+    """Render frames [start, stop) and return raw RGBA bytes, or write PNGs to out_dir"""
+    first, start, stop, starts, samples, spectra, envelope, out_dir = task
+    fft_size = _worker['fft_size']
+    viz_manager = _worker['viz_manager']
+    # pick up the AGC where the previous range left it
+    viz_manager.processor.reset()
+    viz_manager.processor.envelope = envelope
+
+    frames = []
+    for i in range(first, stop):
+        data = None
+        if samples is not None:
+            offset = starts[i - first] - starts[0]
+            data = samples[offset:offset + fft_size]
+        viz_manager.update(data, spectrum=spectra[i - first])
+        if i < start:
+            continue
+        image = _render_image()
+        if out_dir:
+            image.save(os.path.join(out_dir, f"frame_{i:06d}.png"))
+        else:
+            frames.append(image.constBits().asstring(image.sizeInBytes()))
+    return b''.join(frames)
+
+
+def _tasks(starts, spectra, envelopes, frames_per_task, out_dir, padded=None, fft_size=0):
+    """Split the frames into ranges, each carrying only the data needed to render it
+
+    `padded` is the front padded audio, needed only by modes that draw the
+    samples themselves; each range then gets just the slice its windows cover.
+    """
+    for start in range(0, len(starts), frames_per_task):
+        stop = min(start + frames_per_task, len(starts))
+        first = max(0, start - WARMUP_FRAMES)
+        samples = None
+        if padded is not None:
+            samples = padded[starts[first]:starts[stop - 1] + fft_size]
+        yield (first, start, stop, starts[first:stop], samples, spectra[first:stop],
+               envelopes[first], out_dir)
+
+
+def _ordered_results(pool, tasks, limit):
+    """Render tasks in order with at most `limit` submitted but not yet consumed"""
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(_render_range, (task,)))
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _open_encoder(output, audio_file, width, height, fps):
+    """Start ffmpeg reading raw RGBA frames on stdin and muxing in the source audio"""
+    cmd = ["ffmpeg", "-y", "-loglevel", "error",
+           "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}",
+           "-r", str(fps), "-i", "-", "-i", audio_file,
+           "-map", "0:v", "-map", "1:a", "-c:v", "libx264", "-pix_fmt", "yuv420p",
+           "-c:a", "aac", "-shortest", output]
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+
+def export(audio_file, mode, output, fps=FPS, width=WIDTH, height=HEIGHT,
+           fft_size=FFT_SIZE, sensitivity=1.0, workers=None, use_exporter=False):
+    """Render every frame of `audio_file` in visualization `mode`
+
+    Outputs ending in a video extension are encoded with ffmpeg, anything
+    else is treated as a directory for a PNG sequence. Frames are painted
+    straight from the plot widget unless `use_exporter` selects pyqtgraph's
+    ImageExporter.
+    """
+    if mode not in EXPORT_MODES:
+        raise ValueError(f"Cannot export mode '{mode}', choose from {EXPORT_MODES}")
+    started = time.perf_counter()
+
+    y, sr = librosa.load(audio_file, sr=None)
+    config = AnalysisConfig(sample_rate=sr, fft_size=fft_size)
+    starts = frame_starts(len(y), sr, fps)
+    spectra, peaks = analyse(y, starts, config)
+    # the AGC is sequential, so track its envelope here and hand each range its start
+    if mode != "Waveform":
+        peaks = spectra.max(axis=1)
+    envelopes = SpectrumProcessor(config, fps).track_envelope(peaks)
+
+    to_video = output.lower().endswith(VIDEO_EXTENSIONS)
+    out_dir = None if to_video else output
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    encoder = _open_encoder(output, audio_file, width, height, fps) if to_video else None
+
+    workers = workers or os.cpu_count() or 1
+    # only the waveform draws samples, the other modes render from the spectra alone
+    padded = np.pad(y, (config.fft_size, 0)) if mode == "Waveform" else None
+    tasks = _tasks(starts, spectra, envelopes, max(1, fps), out_dir, padded, config.fft_size)
+    init_args = (mode, config, fps, width, height, sensitivity, use_exporter)
+    pool = None
+    try:
+        if workers == 1:
+            _init_worker(*init_args)
+            results = map(_render_range, tasks)
+        else:
+            ctx = mp.get_context("spawn")  # Qt state must not be forked
+            pool = ctx.Pool(workers, initializer=_init_worker, initargs=init_args)
+            results = _ordered_results(pool, tasks, workers * TASKS_PER_WORKER)
+        for raw in results:
+            if encoder:
+                try:
+                    encoder.stdin.write(raw)
+                except BrokenPipeError:
+                    break  # ffmpeg exited early, reported below
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        if encoder:
+            try:
+                encoder.stdin.close()
+            except BrokenPipeError:
+                pass
+            encoder.wait()
+    if encoder and encoder.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed with exit code {encoder.returncode}")
+
+    elapsed = time.perf_counter() - started
+    duration = len(y) / sr
+    print(f"Rendered {len(starts)} frames in {elapsed:.1f}s "
+          f"({duration / elapsed:.1f}x real time) to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a visualization of an audio file offline")
+    parser.add_argument("audio_file")
+    parser.add_argument("mode", choices=EXPORT_MODES)
+    parser.add_argument("output", help="video file (.mp4, .mkv, ...) or PNG sequence directory")
+    parser.add_argument("--fps", type=int, default=FPS)
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--fft-size", type=int, default=FFT_SIZE)
+    parser.add_argument("--sensitivity", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--exporter", action="store_true",
+                        help="render frames with pyqtgraph's ImageExporter (slower)")
+    args = parser.parse_args()
+
+    export(args.audio_file, args.mode, args.output, fps=args.fps, width=args.width,
+           height=args.height, fft_size=args.fft_size, sensitivity=args.sensitivity,
+           workers=args.workers, use_exporter=args.exporter)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+# Default processing settings, times in seconds
+ATTACK = 0.01  # AGC reaction to a louder signal
+RELEASE = 2.0  # AGC recovery after the signal gets quieter
+TARGET = 0.5  # peak the AGC steers towards (-6 dB)
+MIN_GAIN = 0.1
+MAX_GAIN = 100.0  # +40 dB, stops a silent room being boosted into noise
+BAND_ATTACK = 0.02
+BAND_RELEASE = 0.08
+WAVE_SMOOTHING = 0.09
+
+
+def time_coefficient(seconds, frame_rate):
+    """Per frame exponential smoothing coefficient for a time constant"""
+    if seconds <= 0:
+        return 1.0
+    return 1.0 - np.exp(-1.0 / (seconds * frame_rate))
+
+
+class SpectrumProcessor:
+    """Gain control, dB scaling and smoothing applied after capture
+
+    Band levels and the waveform are smoothed in arrays allocated up front,
+    so each frame costs O(bins) without allocating.
+    """
+
+    def __init__(self, config, frame_rate, attack=ATTACK, release=RELEASE,
+                 target=TARGET, min_gain=MIN_GAIN, max_gain=MAX_GAIN,
+                 band_attack=BAND_ATTACK, band_release=BAND_RELEASE,
+                 wave_smoothing=WAVE_SMOOTHING):
+        self.config = config
+        self.sensitivity = 1.0  # manual gain on top of the AGC
+        self.agc = True
+        self.target = target
+        self.min_gain = min_gain
+        self.max_gain = max_gain
+        self.attack = time_coefficient(attack, frame_rate)
+        self.release = time_coefficient(release, frame_rate)
+        self.band_attack = time_coefficient(band_attack, frame_rate)
+        self.band_release = time_coefficient(band_release, frame_rate)
+        self.wave_coeff = time_coefficient(wave_smoothing, frame_rate)
+
+        self.levels = np.zeros(config.n_bars)
+        self.wave = np.zeros(config.fft_size)
+        self._scratch = np.empty(config.n_bars)
+        self._coeffs = np.empty(config.n_bars)
+        self._rising = np.empty(config.n_bars, dtype=bool)
+        self._wave_scratch = np.empty(config.fft_size)
+        self.reset()
+
+    def reset(self):
+        self.envelope = 0.0
+        self.gain = 1.0
+        self.input_db = self.config.db_floor
+        self.levels[:] = 0
+        self.wave[:] = 0
+
+    def db(self, value):
+        """Level of a single magnitude in dB relative to config.ref (dBFS by default)"""
+        return 20 * np.log10(max(value / self.config.ref, 1e-12))
+
+    def level(self, value):
+        """Map a single magnitude onto the [0, 1] dB display range"""
+        db = self.db(value)
+        return min(max(1 - db / self.config.db_floor, 0.0), 1.0)
+
+    def _update_gain(self, peak):
+        """Follow the frame peak with attack/release and steer it towards the target"""
+        coeff = self.attack if peak > self.envelope else self.release
+        self.envelope += coeff * (peak - self.envelope)
+        if self.agc and self.envelope > 0:
+            self.gain = min(max(self.target / self.envelope, self.min_gain), self.max_gain)
+        else:
+            self.gain = 1.0
+        return self.gain * self.sensitivity
+
+    def track_envelope(self, peaks):
+        """AGC envelope before each frame of a whole file of frame peaks"""
+        envelopes = np.empty(len(peaks))
+        for i, peak in enumerate(peaks):
+            envelopes[i] = self.envelope
+            self._update_gain(peak)
+        self.reset()
+        return envelopes
+
+    def process(self, bands):
+        """Smoothed [0, 1] levels for one frame of linear band magnitudes"""
+        gain = self._update_gain(float(bands.max()))
+        out = self._scratch
+        np.multiply(bands, gain / self.config.ref, out=out)
+        np.maximum(out, 1e-12, out=out)
+        np.log10(out, out=out)
+        out *= -20 / self.config.db_floor
+        out += 1
+        np.clip(out, 0, 1, out=out)
+
+        # rise with the attack coefficient, fall with the release one
+        np.greater(out, self.levels, out=self._rising)
+        np.multiply(self._rising, self.band_attack - self.band_release, out=self._coeffs)
+        self._coeffs += self.band_release
+        out -= self.levels
+        out *= self._coeffs
+        self.levels += out
+        return self.levels
+
+    def process_waveform(self, data):
+        """Gain controlled, smoothed copy of one analysis window"""
+        peak = max(float(data.max()), -float(data.min()))
+        rms = np.sqrt(np.dot(data, data) / len(data))
+        self.input_db = self.db(rms * self.sensitivity)
+        gain = self._update_gain(peak)
+
+        out = self._wave_scratch
+        np.multiply(data, gain, out=out)
+        out -= self.wave
+        out *= self.wave_coeff
+        self.wave += out
+        return self.wave
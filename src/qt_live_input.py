@@ -1,3 +1,5 @@
+from collections import deque
+
 import numpy as np
 import sounddevice as sd
 
@@ -5,10 +7,12 @@ from PyQt6.QtWidgets import (QMainWindow, QPushButton, QFileDialog, QWidget,
                              QVBoxLayout, QSlider, QComboBox, QLabel)
 from PyQt6.QtCore import QTimer
 from PyQt6.uic.load_ui import loadUi
-import pyqtgraph as pg
 
+from analysis import AnalysisConfig, SlidingWindow
 from file_input import AudioFeatureExtractor
-from vis_manager import VisualizationManager
+from session import (MAX_SESSION_MB, SESSION_DIR, SESSION_EXT, SessionWriter,
+                     new_session_path)
+from vis_manager import VisualizationManager, create_plot_widget
 
 
 # TODO
@@ -17,18 +21,16 @@ from vis_manager import VisualizationManager
 # - Add recording ability
 
 # Audio input configuration
-SR = 44100
-CHUNK = 2048
 UPDATE_INTERVAL = 20
 
 
 class AudioStream:
     """Manages audio input stream"""
     
-    def __init__(self, callback, sample_rate=SR, chunk_size=CHUNK):
+    def __init__(self, callback, config):
         self.callback = callback
-        self.sample_rate = sample_rate
-        self.chunk_size = chunk_size
+        self.sample_rate = config.sample_rate
+        self.blocksize = config.blocksize
         self.stream = None
     
     def start(self):
@@ -36,7 +38,8 @@ class AudioStream:
         self.stream = sd.InputStream(
             channels=1,
             samplerate=self.sample_rate,
-            blocksize=self.chunk_size,
+            blocksize=self.blocksize,
+            latency='low',
             callback=self.callback
         )
         self.stream.start()
@@ -68,22 +71,33 @@ class AudioVisualizer(QMainWindow):
     axesButton: QPushButton
     loadButton: QPushButton
     
-    def __init__(self):
+    def __init__(self, config=None, record=True, session_dir=SESSION_DIR,
+                 max_session_mb=MAX_SESSION_MB):
         super().__init__()
         loadUi("main_window.ui", self)
         
-        self.data = np.zeros(CHUNK)
+        self.config = config or AnalysisConfig()
+        self.window = SlidingWindow(self.config)
         self.sensitivity = 1.0
+        self.record = record
+        self.session_dir = session_dir
+        self.max_session_bytes = int(max_session_mb * 1024 * 1024)
+        # captured blocks waiting to be appended to the session file
+        self.recorded = deque()
+        self.session_writer = None
 
         self.extractor = AudioFeatureExtractor(loadLabel=self.loadLabel)
         
         self.setup_plot_widget()
-        self.viz_manager = VisualizationManager(self.plot_widget, self.extractor, CHUNK)
+        # hops that arrive between timer ticks are skipped, so at most one frame per tick
+        frame_rate = min(self.config.sample_rate / self.config.hop, 1000 / UPDATE_INTERVAL)
+        self.viz_manager = VisualizationManager(self.plot_widget, self.extractor, self.config,
+                                                frame_rate=frame_rate)
         self.viz_manager.setup("Waveform")
 
         self.liveInputButton.hide()
         
-        self.audio_stream = AudioStream(self.audio_callback)
+        self.audio_stream = AudioStream(self.audio_callback, self.config)
 
         self.axes_shown = True
         
@@ -103,14 +117,7 @@ class AudioVisualizer(QMainWindow):
 
     def setup_plot_widget(self):
         """Setup pyqtgraph plot widget"""
-        self.plot_widget = pg.PlotWidget()
-        self.plot_widget.setBackground('#1a1a2e')
-        self.plot_widget.showGrid(x=False, y=False)
-        self.plot_widget.setMouseEnabled(x=False, y=False)
-        self.plot_widget.getViewBox().setMenuEnabled(False)
-        self.plot_widget.hideButtons()
-        self.plot_widget.getAxis('left').setPen('#444')
-        self.plot_widget.getAxis('bottom').setPen('#444')
+        self.plot_widget = create_plot_widget()
         
         # Create file visualization container (hidden initially)
         self.file_viz_widget = QWidget()
@@ -147,9 +154,15 @@ class AudioVisualizer(QMainWindow):
         self.plot_widget.show()
 
     def load_audio(self):
-        filename, _ = QFileDialog.getOpenFileName(self, "Open Audio File", "", "Audio Files (*.wav *.mp3 *.flac *.ogg *.m4a);;All Files (*)")
-        self.extractor.load_audio(filename)
+        filename, _ = QFileDialog.getOpenFileName(self, "Open Audio File", "", f"Audio Files (*.wav *.mp3 *.flac *.ogg *.m4a);;Sessions (*{SESSION_EXT});;All Files (*)")
+        if not filename:
+            return
+        # switch first, selecting "Audio Stream" resets the extractor's data
         self.switch_to_file_viz()
+        if filename.endswith(SESSION_EXT):
+            self.extractor.load_session(filename)
+        else:
+            self.extractor.load_audio(filename)
 
     def switch_to_file_viz(self):
         """Switch plot area to show file visualizations"""
@@ -185,6 +198,9 @@ class AudioVisualizer(QMainWindow):
     
     def start_audio(self):
         """Start audio capture"""
+        self.window.reset()
+        if self.record:
+            self.open_session()
         self.audio_stream.start()
         self.timer.start(UPDATE_INTERVAL)
         self.startButton.setText("⏸ STOP") 
@@ -196,6 +212,9 @@ class AudioVisualizer(QMainWindow):
         """Stop audio capture"""
         self.audio_stream.stop()
         self.timer.stop()
+        if self.session_writer:
+            self.save_recorded()
+            self.close_session()
         self.startButton.setText("▶ START")
         self.startButton.setProperty("isActive", "false")
         self.startButton.style().unpolish(self.startButton) # refresh
@@ -204,15 +223,65 @@ class AudioVisualizer(QMainWindow):
     def update_sensitivity(self, value):
         """Update sensitivity setting"""
         self.sensitivity = value / 10.0
+        self.viz_manager.processor.sensitivity = self.sensitivity
         self.sensValueLabel.setText(f"{self.sensitivity:.1f}x")
     
     def audio_callback(self, indata, frames, time, status):
         """Audio input callback"""
-        self.data = np.squeeze(indata) * self.sensitivity
+        block = np.squeeze(indata)
+        self.window.write(block)
+        if self.session_writer is not None:
+            self.recorded.append(block.copy())
+    
+    def open_session(self):
+        """Start recording to a new session file, carrying on without one if that fails"""
+        try:
+            path = new_session_path(self.session_dir)
+            self.session_writer = SessionWriter(path, self.config.sample_rate)
+        except OSError as e:
+            self.recording_failed(e)
+    
+    def close_session(self):
+        try:
+            self.session_writer.close()
+        except OSError as e:
+            print(f'Error closing session: {str(e)}')
+        self.session_writer = None
+        self.recorded.clear()
+    
+    def recording_failed(self, error):
+        """Drop recording but keep visualizing"""
+        self.loadLabel.setText(f'Recording stopped: {str(error)}')
+        print(f'Recording stopped: {str(error)}')
+        if self.session_writer:
+            self.close_session()
+    
+    def save_recorded(self):
+        """Append captured blocks to the session file"""
+        if self.session_writer is None:
+            self.recorded.clear()
+            return
+        try:
+            while self.recorded:
+                self.session_writer.append(self.recorded.popleft())
+        except OSError as e:
+            self.recording_failed(e)
+            return
+        if self.session_writer.position >= self.max_session_bytes:
+            print(f'Session reached {self.max_session_bytes // (1024 * 1024)} MB, recording stopped')
+            self.close_session()
     
     def update_visualization(self):
         """Update visualization with latest audio data"""
-        self.viz_manager.update(self.data)
+        self.save_recorded()
+        if self.viz_manager.current_viz == "Audio Stream":
+            # the stream plots every captured sample, not just the latest window
+            data = self.window.read_new()
+            if len(data):
+                # this mode skips the processor, so apply the manual gain here
+                self.viz_manager.update(data * self.sensitivity)
+        elif self.window.ready():
+            self.viz_manager.update(self.window.next_window())
     
     def closeEvent(self, event):
         """Clean up on close"""
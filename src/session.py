@@ -0,0 +1,256 @@
+import os
+import struct
+import time
+
+import librosa
+import numpy as np
+
+
+# Session file layout, all little endian and 4 byte aligned:
+#   header  | MAGIC, version, sample rate, feature count, padding
+#   frames  | FRAME_TAG, n_samples, n_samples float32 PCM, n_features float32 features
+#   index   | int64 byte offset of every frame (written on close)
+#   footer  | index offset, frame count, INDEX_MAGIC
+# Frames are appended as they are captured; a file without a footer (e.g.
+# after a crash) is still readable, its index is rebuilt by scanning.
+# Each frame's features come from a FEATURE_FRAME long window centred on
+# the frame's first sample, the same framing the file view uses.
+MAGIC = b'AVSESS\x00\x00'
+INDEX_MAGIC = b'AVSINDEX'
+VERSION = 1
+FRAME_TAG = 0x4D415246  # 'FRAM'
+HEADER = struct.Struct('<8sIIII8x')
+FRAME_HEADER = struct.Struct('<II')
+FOOTER = struct.Struct('<QQ8s')
+
+SESSION_EXT = '.avs'
+SESSION_DIR = 'sessions'
+MAX_SESSION_MB = 1024  # recording stops at this size, about 1.6 hours of mono 44.1 kHz
+FEATURES = ('rms', 'centroid', 'zcr')
+FEATURE_FRAME = 2048  # librosa's default frame length, as in the file view
+ENVELOPE_CHUNK = 4096  # frames read at a time when building the waveform envelope
+
+
+def frame_features(y, sample_rate, hop):
+    """(n_frames, 3) volume, brightness and percussion of windows every hop samples
+
+    Windows start at y[0] rather than being centred, so callers pad y by
+    half a frame to centre them on the positions they want.
+    """
+    frames = dict(hop_length=hop, center=False)
+    rms = librosa.feature.rms(y=y, frame_length=FEATURE_FRAME, **frames)[0]
+    centroid = librosa.feature.spectral_centroid(y=y, sr=sample_rate, n_fft=FEATURE_FRAME,
+                                                 **frames)[0]
+    zcr = librosa.feature.zero_crossing_rate(y, frame_length=FEATURE_FRAME, **frames)[0]
+    return np.stack((rms, centroid, zcr), axis=1)
+
+
+def new_session_path(directory=SESSION_DIR):
+    """Timestamped path, numbered if several sessions start within one second"""
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime('session_%Y%m%d_%H%M%S')
+    path = os.path.join(directory, stamp + SESSION_EXT)
+    count = 1
+    while os.path.exists(path):
+        count += 1
+        path = os.path.join(directory, f'{stamp}_{count}{SESSION_EXT}')
+    return path
+
+
+class SessionWriter:
+    """Appends captured blocks and their features to a session file
+
+    A block is held back until the feature window centred on its start has
+    all its samples, i.e. half a feature frame of lookahead.
+    """
+
+    def __init__(self, path, sample_rate):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.n_features = len(FEATURES)
+        self.offsets = []
+        self.pending = []  # blocks waiting for lookahead
+        # audio just before the first pending block, zeros before the session starts
+        self.context = np.zeros(FEATURE_FRAME // 2, dtype=np.float32)
+        self.file = open(path, 'xb')  # never overwrite an earlier session
+        self.file.write(HEADER.pack(MAGIC, VERSION, sample_rate, self.n_features, 0))
+        self.position = HEADER.size
+
+    def append(self, pcm):
+        """Queue one captured block, writing every block whose features are complete"""
+        pcm = np.asarray(pcm, dtype='<f4')
+        if len(pcm):
+            self.pending.append(pcm)
+            self._write_ready()
+
+    def _write_ready(self, final=False):
+        half = FEATURE_FRAME // 2
+        parts = [self.context] + self.pending
+        if final:
+            parts.append(np.zeros(half, dtype=np.float32))
+        audio = np.concatenate(parts)
+
+        # block k's window starts half a frame before it, at the end of the blocks before it,
+        # so a run of equal length blocks is one librosa call with the block length as hop
+        start = 0
+        written = 0
+        while written < len(self.pending):
+            size = len(self.pending[written])
+            run = written
+            while run < len(self.pending) and len(self.pending[run]) == size:
+                run += 1
+            available = len(audio) - start
+            if available < FEATURE_FRAME:
+                break
+            n = min(run - written, 1 + (available - FEATURE_FRAME) // size)
+            features = frame_features(audio[start:start + (n - 1) * size + FEATURE_FRAME],
+                                      self.sample_rate, size)
+            self._write_frames(self.pending[written:written + n], features)
+            start += n * size
+            written += n
+            if written < run:
+                break  # the rest of the run is still waiting for lookahead
+        self.pending = self.pending[written:]
+        self.context = audio[start:start + half]
+
+    def _write_frames(self, blocks, features):
+        """Write blocks and their feature rows as a single buffer"""
+        features = np.asarray(features, dtype='<f4')
+        parts = []
+        for pcm, row in zip(blocks, features):
+            self.offsets.append(self.position)
+            parts += [FRAME_HEADER.pack(FRAME_TAG, len(pcm)), pcm.tobytes(), row.tobytes()]
+            self.position += FRAME_HEADER.size + pcm.nbytes + row.nbytes
+        self.file.write(b''.join(parts))
+
+    def close(self):
+        """Write the remaining blocks, then the frame index and footer"""
+        if self.file.closed:
+            return
+        try:
+            self._write_ready(final=True)
+            self.file.write(np.asarray(self.offsets, dtype='<i8').tobytes())
+            self.file.write(FOOTER.pack(self.position, len(self.offsets), INDEX_MAGIC))
+        finally:
+            self.file.close()
+
+
+class Session:
+    """Memory mapped view of a saved session with constant time frame access"""
+
+    def __init__(self, path):
+        self.path = path
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        # a file cut off mid-write may not end on a word boundary
+        self.data = data[:len(data) - len(data) % 4]
+        self.words = self.data.view('<u4')
+        self.samples = self.data.view('<f4')
+
+        magic, version, self.sample_rate, self.n_features, _ = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a session file")
+        if version != VERSION:
+            raise ValueError(f"Unsupported session version {version}")
+
+        self.offsets = self._read_index()
+        first_words = self.offsets // 4
+        self.frame_lengths = self.words[first_words + 1].astype(np.int64)
+        # word index of each frame's PCM and features in self.samples
+        self._pcm_starts = first_words + FRAME_HEADER.size // 4
+        self._feature_starts = self._pcm_starts + self.frame_lengths
+        # sample position of each frame within the session
+        self.sample_starts = np.concatenate(([0], np.cumsum(self.frame_lengths)))
+        self._features = None
+        self._envelope = None
+
+    def _read_index(self):
+        data = self.data
+        if len(data) >= HEADER.size + FOOTER.size:
+            index_offset, n_frames, magic = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+            if magic == INDEX_MAGIC:
+                return np.frombuffer(data, dtype='<i8', count=n_frames, offset=index_offset)
+        return self._scan_index(data)
+
+    def _scan_index(self, data):
+        """Rebuild the index of a session that was not closed cleanly"""
+        offsets = []
+        position = HEADER.size
+        while position + FRAME_HEADER.size <= len(data):
+            tag, n_samples = FRAME_HEADER.unpack_from(data, position)
+            size = FRAME_HEADER.size + 4 * (n_samples + self.n_features)
+            if tag != FRAME_TAG or position + size > len(data):
+                break
+            offsets.append(position)
+            position += size
+        return np.asarray(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def n_samples(self):
+        return int(self.sample_starts[-1])
+
+    @property
+    def duration(self):
+        return self.sample_starts[-1] / self.sample_rate
+
+    @property
+    def frame_times(self):
+        return self.sample_starts[:-1] / self.sample_rate
+
+    @property
+    def features(self):
+        """(n_frames, n_features) array of every stored feature vector"""
+        if self._features is None:
+            index = self._feature_starts[:, None] + np.arange(self.n_features)
+            self._features = self.samples[index]
+        return self._features
+
+    @property
+    def envelope(self):
+        """Per frame (min, max) of the PCM, built in chunks so the session is never fully loaded"""
+        if self._envelope is None:
+            lows = np.empty(len(self), dtype=np.float32)
+            highs = np.empty(len(self), dtype=np.float32)
+            for start in range(0, len(self), ENVELOPE_CHUNK):
+                stop = min(start + ENVELOPE_CHUNK, len(self))
+                pcm = self.pcm(start, stop)
+                bounds = self.sample_starts[start:stop] - self.sample_starts[start]
+                lows[start:stop] = np.minimum.reduceat(pcm, bounds)
+                highs[start:stop] = np.maximum.reduceat(pcm, bounds)
+            self._envelope = (lows, highs)
+        return self._envelope
+
+    def frame(self, i):
+        """PCM and features of frame i as views into the file"""
+        start = self._pcm_starts[i]
+        end = self._feature_starts[i]
+        return self.samples[start:end], self.samples[end:end + self.n_features]
+
+    def seek(self, seconds):
+        """Index of the frame playing at a given time"""
+        sample = int(round(seconds * self.sample_rate))
+        return int(np.clip(np.searchsorted(self.sample_starts, sample, side='right') - 1,
+                           0, max(len(self) - 1, 0)))
+
+    def pcm(self, start=0, stop=None):
+        """Concatenated PCM of frames [start, stop)"""
+        stop = len(self) if stop is None else stop
+        if stop <= start:
+            return np.zeros(0, dtype=np.float32)
+        # map each session sample position to its word in the file
+        shift = self._pcm_starts[start:stop] - self.sample_starts[start:stop]
+        index = np.repeat(shift, self.frame_lengths[start:stop])
+        index += np.arange(self.sample_starts[start], self.sample_starts[stop])
+        return self.samples[index]
+
+    def read(self, start, stop):
+        """PCM samples [start, stop) of the session, reading only the frames holding them"""
+        start, stop = max(start, 0), min(stop, self.n_samples)
+        if stop <= start:
+            return np.zeros(0, dtype=np.float32)
+        first = self.seek(start / self.sample_rate)
+        last = self.seek((stop - 1) / self.sample_rate) + 1
+        offset = self.sample_starts[first]
+        return self.pcm(first, last)[start - offset:stop - offset]
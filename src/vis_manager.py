@@ -1,16 +1,40 @@
 import numpy as np
 import pyqtgraph as pg
 
+from analysis import batch_spectrum
+from processing import SpectrumProcessor
+
+
+# Waveform colour thresholds for the input RMS in dBFS, independent of the display floor
+QUIET_DB = -52.0
+LOUD_DB = -40.0
+
+
+def create_plot_widget():
+    """Create a pyqtgraph plot widget with the app's dark styling"""
+    plot_widget = pg.PlotWidget()
+    plot_widget.setBackground('#1a1a2e')
+    plot_widget.showGrid(x=False, y=False)
+    plot_widget.setMouseEnabled(x=False, y=False)
+    plot_widget.getViewBox().setMenuEnabled(False)
+    plot_widget.hideButtons()
+    plot_widget.getAxis('left').setPen('#444')
+    plot_widget.getAxis('bottom').setPen('#444')
+    return plot_widget
 
-K = 80  # constant spectrum multiplier
 
 class VisualizationManager:
     """Manages different visualization types and their rendering"""
     
-    def __init__(self, plot_widget, extractor, chunk_size):
+    def __init__(self, plot_widget, extractor, config, frame_rate=None):
         self.plot_widget = plot_widget
         self.extractor = extractor
-        self.chunk_size = chunk_size
+        self.config = config
+        self.n_bars = config.n_bars
+        # frames processed per second, which sets the smoothing and AGC time constants;
+        # defaults to one per hop when every hop is drawn
+        frame_rate = frame_rate or config.sample_rate / config.hop
+        self.processor = SpectrumProcessor(config, frame_rate)
         self.visualizations = {}
         self.current_viz = None
         self.file_mode = False
@@ -20,6 +44,7 @@ class VisualizationManager:
         # Clear other setups
         self.plot_widget.clear()
         self.visualizations.clear()
+        self.processor.reset()
         self.plot_widget.setAspectLocked(False)
         
         viz_configs = {
@@ -37,13 +62,13 @@ class VisualizationManager:
     
     def _setup_freq_bars(self):
         self.visualizations['freq_bars'] = pg.BarGraphItem(
-            x=np.arange(self.chunk_size // 2),
-            height=np.zeros(self.chunk_size // 2),
+            x=np.arange(self.n_bars),
+            height=np.zeros(self.n_bars),
             width=0.8, brush='#00d4ff'
         )
         self.plot_widget.addItem(self.visualizations['freq_bars'])
         self.plot_widget.setYRange(0, 1)
-        self.plot_widget.setXRange(0, self.chunk_size // 2)
+        self.plot_widget.setXRange(0, self.n_bars)
     
     
     def _setup_waveform(self):
@@ -54,7 +79,6 @@ class VisualizationManager:
             # the width of the waveform is 7, the initial color is pink 
             pen=pg.mkPen('#ff4fa3', width=7)
         )
-        self.smoothed = None
         self.plot_widget.setYRange(-1, 1)
         
        
@@ -65,7 +89,7 @@ class VisualizationManager:
             fillLevel=0, brush=(255, 0, 255, 100)
         )
         self.plot_widget.setYRange(0, 1)
-        self.plot_widget.setXRange(0, self.chunk_size // 2)
+        self.plot_widget.setXRange(0, self.n_bars)
     
     def _setup_circular(self):
         self.visualizations['circular'] = self.plot_widget.plot(
@@ -77,27 +101,31 @@ class VisualizationManager:
     
     def _setup_stereo_bars(self):
         self.visualizations['stereo_top'] = pg.BarGraphItem(
-            x=np.arange(self.chunk_size // 4),
-            height=np.zeros(self.chunk_size // 4),
+            x=np.arange(self.n_bars // 4),
+            height=np.zeros(self.n_bars // 4),
             width=0.8, brush='#00d4ff'
         )
         self.visualizations['stereo_bottom'] = pg.BarGraphItem(
-            x=np.arange(self.chunk_size // 4),
-            height=np.zeros(self.chunk_size // 4),
+            x=np.arange(self.n_bars // 4),
+            height=np.zeros(self.n_bars // 4),
             width=0.8, brush='#ff00ff'
         )
         self.plot_widget.addItem(self.visualizations['stereo_top'])
         self.plot_widget.addItem(self.visualizations['stereo_bottom'])
         self.plot_widget.setYRange(-1, 1)
-        self.plot_widget.setXRange(0, self.chunk_size // 4)
+        self.plot_widget.setXRange(0, self.n_bars // 4)
     
     def _setup_audio_stream(self):
         self.extractor.reset_audio_data()
         self.extractor.extract_and_visualize()
 
     
-    def update(self, data):
-        """Update visualization with new audio data"""
+    def update(self, data, spectrum=None):
+        """Update visualization with new audio data
+        
+        `spectrum` may hold precomputed `batch_spectrum` band magnitudes for
+        `data` (used by the offline renderer); otherwise they are computed here.
+        """
         update_methods = {
             "Frequency Bars": self._update_freq_bars,
             "Waveform": self._update_waveform,
@@ -108,38 +136,26 @@ class VisualizationManager:
         }
         
         if self.current_viz in update_methods:
-            update_methods[self.current_viz](data)
+            update_methods[self.current_viz](data, spectrum)
     
-    def _create_spectrum(self, data, max_values):
-        windowed = data * np.hamming(len(data))
-        fft = np.fft.rfft(windowed)
-        spectrum = np.abs(fft[:max_values]) * K / self.chunk_size # amplify fft height
-        return np.clip(spectrum, 0, 1)
+    def _create_spectrum(self, data, max_values, spectrum=None):
+        if spectrum is None:
+            spectrum = batch_spectrum(data, self.config)
+        return self.processor.process(spectrum)[:max_values]
     
-    def _update_freq_bars(self, data):
-        spectrum = self._create_spectrum(data, self.chunk_size // 2)
-        
-        # Smooth bars by reducing maximum change
-        bars = self.visualizations['freq_bars']
-        current = bars.opts['height']
-        spectrum = np.maximum(spectrum, current * 0.7)
-        bars.setOpts(height=spectrum)
+    def _update_freq_bars(self, data, spectrum=None):
+        spectrum = self._create_spectrum(data, self.n_bars, spectrum)
+        self.visualizations['freq_bars'].setOpts(height=spectrum)
     
-    def _update_waveform(self, data):
+    def _update_waveform(self, data, spectrum=None):
         """Changing waveform with colors"""
-        # animation 
-        if self.smoothed is None:
-            self.smoothed = data
-        else:
-            self.smoothed = 0.2 * data + 0.8 * self.smoothed  
-        y = self.smoothed
-        # amplitude calculation 
-        amplitude = np.sqrt(np.mean(y**2))
+        y = self.processor.process_waveform(data)
+        level = self.processor.input_db
         # color change 
-        if amplitude < 0.0025:
+        if level < QUIET_DB:
             w = (255, 160, 70)       
     # medium sounds -> pink 
-        elif amplitude < 0.010:
+        elif level < LOUD_DB:
             w = (255, 60, 180)       
     # loud sounds -> purple 
         else:
@@ -150,32 +166,32 @@ class VisualizationManager:
         self.wave_curve.setData(y)
         
     
-    def _update_spectrum_line(self, data):
-        spectrum = self._create_spectrum(data, self.chunk_size // 2)
+    def _update_spectrum_line(self, data, spectrum=None):
+        spectrum = self._create_spectrum(data, self.n_bars, spectrum)
         self.visualizations['spectrum'].setData(spectrum)
     
     # circular waveform specifications 
-    def _update_circular(self, data):
-        spectrum = self._create_spectrum(data, 180)
+    def _update_circular(self, data, spectrum=None):
+        spectrum = self._create_spectrum(data, 180, spectrum)
         
         # Using NumPy broadcasting
-        angles = np.linspace(0, 2 * np.pi, 180)
+        angles = np.linspace(0, 2 * np.pi, len(spectrum))  # fewer than 180 with few bars
         radius = 0.5 + spectrum
         x = np.append(radius * np.cos(angles), radius[0] * np.cos(angles[0]))
         y = np.append(radius * np.sin(angles), radius[0] * np.sin(angles[0]))
         
         self.visualizations['circular'].setData(x, y)
     
-    def _update_stereo_bars(self, data):
-        spectrum = self._create_spectrum(data, self.chunk_size // 8)
+    def _update_stereo_bars(self, data, spectrum=None):
+        spectrum = self._create_spectrum(data, self.n_bars // 8, spectrum)
         
         mirrored = np.append(spectrum[::-1], spectrum)
 
         self.visualizations['stereo_top'].setOpts(height=mirrored)
         self.visualizations['stereo_bottom'].setOpts(height=-mirrored)
     
-    def _update_audio_stream(self, data):
+    def _update_audio_stream(self, data, spectrum=None):
         # print(data)
-        self.extractor.update_audio_data(data)
+        self.extractor.update_audio_data(data, self.config.sample_rate)
         self.extractor.extract_and_visualize()
         # self.visualizations['waveform'].setData(data)